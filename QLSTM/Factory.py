@@ -1,6 +1,7 @@
 import torch
 from torch import nn
 from torch.utils.data import Dataset
+from torch.utils.checkpoint import checkpoint
 import pennylane as qml
 
 class SequenceDataset(Dataset):
@@ -61,7 +62,9 @@ class QLSTM(nn.Module):
                 batch_first=True,
                 return_sequences=False, 
                 return_state=False,
-                backend="default.qubit"):
+                backend="default.qubit",
+                tbptt_steps=None,
+                checkpoint_cells=False):
         super(QLSTM, self).__init__()
         self.n_inputs = input_size
         self.hidden_size = hidden_size
@@ -74,6 +77,11 @@ class QLSTM(nn.Module):
         self.batch_first = batch_first
         self.return_sequences = return_sequences
         self.return_state = return_state
+
+        # Memory-bounded training: backprop through at most tbptt_steps steps (see forward and
+        # forward_chunks) and/or recompute each cell on backward instead of keeping its activations.
+        self.tbptt_steps = tbptt_steps
+        self.checkpoint_cells = checkpoint_cells
         
         self.wires_forget = [f"wire_forget_{i}" for i in range(self.n_qubits)]
         self.wires_input = [f"wire_input_{i}" for i in range(self.n_qubits)]
@@ -108,12 +116,13 @@ class QLSTM(nn.Module):
         def VQC(features, weights, wires_type):
             # Preproccess input data to encode the initial state.
             #qml.templates.AngleEmbedding(features, wires=wires_type)
-            ry_params = [torch.arctan(feature) for feature in features]
-            rz_params = [torch.arctan(feature**2) for feature in features]
+            # index the last axis so this works both per sample and for the batches TorchLayer broadcasts
+            ry_params = torch.arctan(features)
+            rz_params = torch.arctan(features**2)
             for i in range(self.n_qubits):
                 qml.Hadamard(wires=wires_type[i])
-                qml.RY(ry_params[i], wires=wires_type[i])
-                qml.RZ(ry_params[i], wires=wires_type[i])
+                qml.RY(ry_params[..., i], wires=wires_type[i])
+                qml.RZ(ry_params[..., i], wires=wires_type[i])
         
             #Variational block.
             qml.layer(ansatz, self.n_qlayers, weights, wires_type = wires_type)
@@ -142,15 +151,36 @@ class QLSTM(nn.Module):
         print(f"weight_shapes = (n_qlayers, n_vrotations, n_qubits) = ({self.n_qlayers}, {self.n_vrotations}, {self.n_qubits})")
 
         self.clayer_in = torch.nn.Linear(self.concat_size, self.n_qubits)
-        self.VQC = {
+        # ModuleDict so the quantum weights are registered parameters (trained and saved in state_dict);
+        # the update block is 'update_gate' because ModuleDict.update is a method name.
+        self.VQC = nn.ModuleDict({
             'forget': qml.qnn.TorchLayer(self.qlayer_forget, weight_shapes),
             'input': qml.qnn.TorchLayer(self.qlayer_input, weight_shapes),
-            'update': qml.qnn.TorchLayer(self.qlayer_update, weight_shapes),
+            'update_gate': qml.qnn.TorchLayer(self.qlayer_update, weight_shapes),
             'output': qml.qnn.TorchLayer(self.qlayer_output, weight_shapes)
-        }
+        })
         self.clayer_out = torch.nn.Linear(self.n_qubits, self.hidden_size)
         #self.clayer_out = [torch.nn.Linear(n_qubits, self.hidden_size) for _ in range(4)]
 
+    def cell(self, x_t, h_t, c_t):
+        '''
+        One recurrent step: x_t is (batch_size, feature_size), h_t and c_t are (batch_size, hidden_size)
+        '''
+        # Concatenate input and hidden state
+        v_t = torch.cat((h_t, x_t), dim=1)
+
+        # match qubit dimension
+        y_t = self.clayer_in(v_t)
+
+        f_t = torch.sigmoid(self.clayer_out(self.VQC['forget'](y_t)))  # forget block
+        i_t = torch.sigmoid(self.clayer_out(self.VQC['input'](y_t)))  # input block
+        g_t = torch.tanh(self.clayer_out(self.VQC['update_gate'](y_t)))  # update block
+        o_t = torch.sigmoid(self.clayer_out(self.VQC['output'](y_t))) # output block
+
+        c_t = (f_t * c_t) + (i_t * g_t)
+        h_t = o_t * torch.tanh(c_t)
+        return h_t, c_t
+
     def forward(self, x, init_states=None):
         '''
         x.shape is (batch_size, seq_length, feature_size)
@@ -162,7 +192,8 @@ class QLSTM(nn.Module):
         else:
             seq_length, batch_size, features_size = x.size()
 
-        hidden_seq = []
+        # Without return_sequences only the last h_t is returned, so the per-step outputs are not kept.
+        hidden_seq = [] if self.return_sequences else None
         if init_states is None:
             h_t = torch.zeros(batch_size, self.hidden_size)  # hidden state (output)
             c_t = torch.zeros(batch_size, self.hidden_size)  # cell state
@@ -173,31 +204,64 @@ class QLSTM(nn.Module):
             h_t = h_t[0]
             c_t = c_t[0]
 
+        no_grad_steps = 0
+        if torch.is_grad_enabled() and self.tbptt_steps and not self.return_sequences:
+            # The loss is taken on the final state, so steps before the last tbptt_steps need no graph.
+            # Sequence losses need a backward per chunk to bound memory: use forward_chunks.
+            no_grad_steps = max(0, seq_length - self.tbptt_steps)
+
         for t in range(seq_length):
             # get features from the t-th element in seq, for all entries in the batch
             x_t = x[:, t, :]
-            
-            # Concatenate input and hidden state
-            v_t = torch.cat((h_t, x_t), dim=1)
-
-            # match qubit dimension
-            y_t = self.clayer_in(v_t)
-
-            f_t = torch.sigmoid(self.clayer_out(self.VQC['forget'](y_t)))  # forget block
-            i_t = torch.sigmoid(self.clayer_out(self.VQC['input'](y_t)))  # input block
-            g_t = torch.tanh(self.clayer_out(self.VQC['update'](y_t)))  # update block
-            o_t = torch.sigmoid(self.clayer_out(self.VQC['output'](y_t))) # output block
-
-            c_t = (f_t * c_t) + (i_t * g_t)
-            h_t = o_t * torch.tanh(c_t)
+            if t < no_grad_steps:
+                with torch.no_grad():
+                    h_t, c_t = self.cell(x_t, h_t, c_t)
+            else:
+                h_t, c_t = self._step(x_t, h_t, c_t)
 
-            hidden_seq.append(h_t.unsqueeze(0))
+            if hidden_seq is not None:
+                hidden_seq.append(h_t.unsqueeze(0))
+        if hidden_seq is None:
+            return h_t.unsqueeze(1), (h_t, c_t)
         hidden_seq = torch.cat(hidden_seq, dim=0)
         hidden_seq = hidden_seq.transpose(0, 1).contiguous()
         return hidden_seq, (h_t, c_t)
+
+    def forward_chunks(self, x, chunk_loss, init_states=None):
+        '''
+        Truncated BPTT for losses over the whole output sequence: runs tbptt_steps steps at a time
+        and calls backward on chunk_loss(hidden_chunk, start) after each chunk, so only one chunk's
+        graph is alive. hidden_chunk is (batch_size, chunk_length, hidden_size), start its first step.
+        Gradients accumulate in .grad for the caller's optimizer step.
+        Returns the summed loss and the final (h_t, c_t), detached.
+        '''
+        batch_size, seq_length = x.shape[0], x.shape[1]
+        if init_states is None:
+            h_t = torch.zeros(batch_size, self.hidden_size)
+            c_t = torch.zeros(batch_size, self.hidden_size)
+        else:
+            h_t, c_t = init_states[0][0], init_states[1][0]
+        steps = self.tbptt_steps or seq_length
+        total = 0.0
+        for start in range(0, seq_length, steps):
+            # chunk boundary: the graph of the previous chunk was freed by its backward
+            h_t, c_t = h_t.detach(), c_t.detach()
+            hidden_chunk = []
+            for t in range(start, min(start + steps, seq_length)):
+                h_t, c_t = self._step(x[:, t, :], h_t, c_t)
+                hidden_chunk.append(h_t)
+            loss = chunk_loss(torch.stack(hidden_chunk, dim=1), start)
+            loss.backward()
+            total += float(loss.detach())
+        return total, (h_t.detach(), c_t.detach())
+
+    def _step(self, x_t, h_t, c_t):
+        if self.checkpoint_cells and torch.is_grad_enabled():
+            return checkpoint(self.cell, x_t, h_t, c_t, use_reentrant=False)
+        return self.cell(x_t, h_t, c_t)
     
 class QShallowRegressionLSTM(nn.Module):
-    def __init__(self, num_sensors, hidden_units, n_qubits=0, n_qlayers=1):
+    def __init__(self, num_sensors, hidden_units, n_qubits=0, n_qlayers=1, tbptt_steps=None, checkpoint_cells=False):
         super().__init__()
         self.num_sensors = num_sensors  # this is the number of features
         self.hidden_units = hidden_units
@@ -215,17 +279,30 @@ class QShallowRegressionLSTM(nn.Module):
             hidden_size=hidden_units,
             batch_first=True,
             n_qubits = n_qubits,
-            n_qlayers= n_qlayers
+            n_qlayers= n_qlayers,
+            tbptt_steps=tbptt_steps,
+            checkpoint_cells=checkpoint_cells
         )
 
         self.linear = nn.Linear(in_features=self.hidden_units, out_features=1)
 
     def forward(self, x):
+        out, _ = self.forward_state(x)
+        return out
+
+    def forward_state(self, x, state=None):
+        '''
+        Same as forward, but starts from state = (h_t, c_t) of shape (batch_size, hidden_units)
+        instead of zeros and also returns the state after the last step, so a caller can resume.
+        '''
         batch_size = x.shape[0]
-        h0 = torch.zeros(self.num_layers, batch_size, self.hidden_units).requires_grad_()
-        c0 = torch.zeros(self.num_layers, batch_size, self.hidden_units).requires_grad_()
-        
-        _, (hn, _) = self.lstm(x, (h0, c0))
-        out = self.linear(hn).flatten()  # First dim of Hn is num_layers, which is set to 1 above.
+        if state is None:
+            h0 = torch.zeros(self.num_layers, batch_size, self.hidden_units).requires_grad_()
+            c0 = torch.zeros(self.num_layers, batch_size, self.hidden_units).requires_grad_()
+        else:
+            h0, c0 = state[0].unsqueeze(0), state[1].unsqueeze(0)
+
+        _, (hn, cn) = self.lstm(x, (h0, c0))
+        out = self.linear(hn).flatten()  # QLSTM returns h_t without the num_layers dim.
 
-        return out
\ No newline at end of file
+        return out, (hn, cn)
\ No newline at end of file
@@ -1,15 +1,28 @@
-from fastapi import FastAPI, UploadFile, File
+from fastapi import FastAPI, UploadFile, File, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response
 from pydantic import BaseModel
 import os
 import io
 import csv
+import json
+import time
+import logging
 import numpy as np
+import pandas as pd
 import requests
 from tensorflow.keras.models import load_model
 import pennylane as qml
 import numpy as np
 import yfinance as yf
+from server.profiling import stage, start_trace, end_trace, profile_requested, record_if_slow
+from server.recurrent import RecurrentModel
+from server.inference import run_cascade
+from server.surrogate import compile_circuit
+from server.dataset import normalize_windows
+from server.ohlc import INTERVALS as OHLC_INTERVALS, INTRADAY as OHLC_INTRADAY, INTRADAY_MAX_DAYS as OHLC_INTRADAY_MAX_DAYS, frame_from_download, frame_from_rows, resample as resample_ohlcv, downsample as downsample_ohlcv, to_rows as ohlc_rows
+
+log = logging.getLogger("server.app")
 
 app = FastAPI()
 app.add_middleware(
@@ -20,11 +33,64 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    profile = profile_requested(request.headers, request.query_params)
+    tr, token = start_trace(request.method, request.url.path, request.url.query, profile)
+    if tr is None:
+        return await call_next(request)
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+    finally:
+        total_ms = tr.finish()
+        end_trace(token)
+        record_if_slow(tr, total_ms, status)
+    if not profile:
+        return response
+    body = b"".join([chunk async for chunk in response.body_iterator])
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        payload = None
+    # Keep the inner layers' headers (CORS in particular); the body length changes.
+    headers = {k: v for k, v in response.headers.items() if k.lower() != "content-length"}
+    if not isinstance(payload, dict):
+        return Response(content=body, status_code=status, headers=headers)
+    payload["profile"] = {"total_ms": round(total_ms, 3), "stages": tr.stages}
+    if tr.sampler is not None:
+        payload["profile"].update(tr.sampler.report())
+    return JSONResponse(payload, status_code=status, headers=headers)
+
 ROOT = os.path.dirname(os.path.dirname(__file__))
 KERAS_PATH = os.path.join(ROOT, "lstm_model.keras")
 QLSTM_WEIGHTS = os.path.join(ROOT, "qlstm_weights.npz")
+QRNN_PATH = os.path.join(ROOT, "qlstm_model.pt")
+# QShallowRegressionLSTM checkpoint; reloaded when the file changes, inactive while it is absent.
+qrnn = RecurrentModel(QRNN_PATH)
 model = None
 qlstm_cfg = None
+
+def make_vqc_circuit(wires):
+    dev = qml.device("default.qubit", wires=wires)
+    @qml.qnode(dev)
+    def circuit(inputs, weights):
+        # inputs is one window or a (N, window) batch, broadcast through the device in one run
+        qml.AngleEmbedding(inputs[..., :wires], wires=range(wires))
+        if np.ndim(weights) == 3:
+            # Rot + CZ ring ansatz written by train_qlstm.py, weights (layers, wires, 3)
+            for l in range(weights.shape[0]):
+                for w in range(wires):
+                    qml.Rot(*weights[l, w], wires=w)
+                for w in range(wires - 1):
+                    qml.CZ(wires=[w, w + 1])
+                qml.CZ(wires=[wires - 1, 0])
+        else:
+            qml.BasicEntanglerLayers(weights, wires=range(wires))
+        return qml.expval(qml.PauliZ(0))
+    return circuit
+
 if os.path.exists(QLSTM_WEIGHTS):
     try:
         npz = np.load(QLSTM_WEIGHTS)
@@ -34,9 +100,24 @@ if os.path.exists(QLSTM_WEIGHTS):
             "wires": int(npz["wires"]),
             "layers": int(npz["layers"]),
         }
+        qlstm_cfg["circuit"] = make_vqc_circuit(qlstm_cfg["wires"])
     except Exception:
+        log.warning("could not load %s", QLSTM_WEIGHTS, exc_info=True)
         qlstm_cfg = None
-elif os.path.exists(KERAS_PATH):
+    if qlstm_cfg is not None:
+        # The weights are fixed, so <Z0> is a fixed trigonometric polynomial of the input angles;
+        # replace the simulator with its coefficients when they reproduce the circuit.
+        try:
+            circuit, weights = qlstm_cfg["circuit"], qlstm_cfg["weights"]
+            qlstm_cfg["surrogate"] = compile_circuit(
+                lambda X: np.asarray(circuit(X, weights), dtype=np.float64),
+                min(qlstm_cfg["window"], qlstm_cfg["wires"]),
+            )
+        except Exception:
+            log.warning("vqc surrogate compile failed", exc_info=True)
+            qlstm_cfg["surrogate"] = None
+# Loaded independently of the VQC so the cascade and ensemble can use both.
+if os.path.exists(KERAS_PATH):
     try:
         model = load_model(KERAS_PATH)
     except Exception:
@@ -47,40 +128,61 @@ class PredictQuery(BaseModel):
     start: str
     end: str
 
-def make_sequences(vals, window=20):
+def make_sequences(vals, window=20, rank=3):
     if len(vals) < window:
         return None
     seq = np.array(vals[-window:], dtype=np.float32)
-    return seq.reshape(1, window, 1)
+    return seq.reshape(1, window, 1) if rank == 3 else seq.reshape(1, window)
 
-def infer_from_closes(closes):
-    arr = np.array(closes, dtype=np.float32)
-    if qlstm_cfg is not None:
-        try:
-            wires = qlstm_cfg["wires"]
-            window = qlstm_cfg["window"]
-            dev = qml.device("default.qubit", wires=wires)
-            @qml.qnode(dev)
-            def circuit(inputs, weights):
-                qml.AngleEmbedding(inputs[:wires], wires=range(wires))
-                qml.BasicEntanglerLayers(weights, wires=range(wires))
-                return qml.expval(qml.PauliZ(0))
-            seq = np.array(arr[-window:], dtype=np.float32)
-            m = float(np.mean(seq)); s = float(np.std(seq)); s = s if s != 0 else 1.0
-            seq = (seq - m) / s
-            z = circuit(seq, qlstm_cfg["weights"])
-            prob = float((z + 1.0) / 2.0)
-            return {"direction": "UP" if prob >= 0.5 else "DOWN", "confidence": int(round(prob * 100))}
-        except Exception:
-            pass
-    if model is not None:
-        try:
-            x = make_sequences(arr.tolist())
-            if x is not None:
-                prob = float(model.predict(x, verbose=0)[0][0])
-                return {"direction": "UP" if prob >= 0.5 else "DOWN", "confidence": int(round(prob * 100))}
-        except Exception:
-            pass
+def keras_input_spec(m):
+    # train.py saves a Dense model over (None, window); LSTM models take (None, window, 1).
+    shape = tuple(m.input_shape)
+    window = int(shape[1]) if len(shape) > 1 and shape[1] else 20
+    return window, len(shape)
+
+def prob_result(prob, direction_confidence=False):
+    # prob is the probability of UP. VQC/Keras/ensemble answers report it as is; the QLSTM
+    # reports confidence in the predicted direction (prob for UP, 1 - prob for DOWN) as it always has.
+    up = prob >= 0.5
+    conf = prob if up or not direction_confidence else 1.0 - prob
+    return {"direction": "UP" if up else "DOWN", "confidence": int(round(conf * 100))}
+
+def qrnn_prob(arr, key, dates=None):
+    with stage("infer.qrnn"):
+        out = qrnn.predict(arr, key, dates)
+    return None if out is None else out["prob"]
+
+def vqc_prob(arr):
+    window = qlstm_cfg["window"]
+    if qlstm_cfg.get("surrogate") is not None:
+        if len(arr) < window:
+            return None
+        with stage("infer.vqc.surrogate"):
+            return float(vqc_batch_prob(arr[-window:][None, :])[0])
+    seq = np.array(arr[-window:], dtype=np.float32)
+    m = float(np.mean(seq)); s = float(np.std(seq)); s = s if s != 0 else 1.0
+    seq = (seq - m) / s
+    with stage("infer.vqc.exec"):
+        z = qlstm_cfg["circuit"](seq, qlstm_cfg["weights"])
+    return float((z + 1.0) / 2.0)
+
+def vqc_batch_prob(windows):
+    # Scores many raw close windows (N, window) at once, e.g. for backtests and universe scans.
+    surrogate = qlstm_cfg.get("surrogate") if qlstm_cfg is not None else None
+    if surrogate is None:
+        raise RuntimeError("no compiled vqc surrogate")
+    X = normalize_windows(np.asarray(windows, dtype=np.float32)[:, -qlstm_cfg["window"]:])
+    return (surrogate(X) + 1.0) / 2.0
+
+def keras_prob(arr):
+    window, rank = keras_input_spec(model)
+    x = make_sequences(arr.tolist(), window, rank)
+    if x is None:
+        return None
+    with stage("infer.keras"):
+        return float(model.predict(x, verbose=0)[0][0])
+
+def sma_result(arr):
     s = arr.astype(np.float32)
     if len(s) < 20:
         return {"direction": "DOWN", "confidence": 50}
@@ -90,8 +192,29 @@ def infer_from_closes(closes):
     confidence = int(round(min(95, max(55, abs((last - sma) / sma) * 100))))
     return {"direction": direction, "confidence": confidence}
 
+def infer_from_closes(closes, key=None, deadline_ms=None, ensemble=False, dates=None):
+    arr = np.array(closes, dtype=np.float32)
+    # Priority order; only models that are loaded are started.
+    candidates = []
+    if os.path.exists(QRNN_PATH):
+        candidates.append(("qlstm", lambda: qrnn_prob(arr, key, dates)))
+    if qlstm_cfg is not None:
+        candidates.append(("vqc", lambda: vqc_prob(arr)))
+    if model is not None:
+        candidates.append(("keras", lambda: keras_prob(arr)))
+    name, prob, timings = run_cascade(candidates, deadline_ms, ensemble)
+    if prob is None:
+        t0 = time.perf_counter()
+        res = sma_result(arr)
+        timings["sma"] = {"status": "ok", "ms": round((time.perf_counter() - t0) * 1000.0, 3)}
+        name = "sma"
+    else:
+        res = prob_result(prob, direction_confidence=(name == "qlstm"))
+    res.update({"model": name, "timings": timings})
+    return res
+
 @app.get("/predict")
-def predict(ticker: str, start: str = "", end: str = ""):
+def predict(ticker: str, start: str = "", end: str = "", deadline_ms: float = None, ensemble: bool = False):
     from datetime import datetime, timedelta
     try:
         if not end:
@@ -99,14 +222,21 @@ def predict(ticker: str, start: str = "", end: str = ""):
         if not start:
             start = (datetime.utcnow().date() - timedelta(days=365)).isoformat()
         try:
-            df = yf.download(ticker, start=start, end=end, progress=False)
+            with stage("fetch.yfinance"):
+                df = yf.download(ticker, start=start, end=end, progress=False)
         except Exception:
             df = None
         closes = None
+        dates = None
         last_date = ""
         source = ""
         if df is not None and not df.empty:
-            closes = df["Close"].dropna().values
+            close = df["Close"]
+            if isinstance(close, pd.DataFrame):
+                close = close.iloc[:, 0]
+            close = close.dropna()
+            closes = close.values
+            dates = [d.date().isoformat() for d in close.index]
             try:
                 last_date = str(df.index[-1].date())
             except Exception:
@@ -122,7 +252,8 @@ def predict(ticker: str, start: str = "", end: str = ""):
                 p1 = int(s_dt.timestamp())
                 p2 = int(e_dt.timestamp())
                 url = f"https://query1.finance.yahoo.com/v8/finance/chart/{ticker}?period1={p1}&period2={p2}&interval=1d&includePrePost=false"
-                r = requests.get(url, timeout=10, headers={"User-Agent": "Mozilla/5.0"}, verify=False)
+                with stage("fetch.yahoo_chart"):
+                    r = requests.get(url, timeout=10, headers={"User-Agent": "Mozilla/5.0"}, verify=False)
                 if r.status_code == 200:
                     j = r.json()
                     result = (j.get("chart", {}).get("result") or [None])[0]
@@ -131,16 +262,20 @@ def predict(ticker: str, start: str = "", end: str = ""):
                     q0 = (q or [None])[0] or {}
                     c = q0.get("close") or []
                     arr = []
+                    ds = []
                     for i in range(min(len(ts), len(c))):
                         try:
                             if c[i] is None:
                                 continue
+                            d = datetime.utcfromtimestamp(int(ts[i])).date().isoformat()
                             arr.append(float(c[i]))
-                            last_date = datetime.utcfromtimestamp(int(ts[i])).date().isoformat()
+                            ds.append(d)
+                            last_date = d
                         except Exception:
                             continue
                     if arr:
                         closes = np.array(arr, dtype=np.float32)
+                        dates = ds
                         source = "yahoo_chart"
             except Exception:
                 pass
@@ -149,25 +284,26 @@ def predict(ticker: str, start: str = "", end: str = ""):
             import io
             def _stooq_fetch(sym):
                 u = f"https://stooq.com/q/d/l/?s={sym}&i=d"
-                resp = requests.get(u, timeout=10, headers={"User-Agent": "Mozilla/5.0"}, verify=False)
+                with stage(f"fetch.stooq.{sym}"):
+                    resp = requests.get(u, timeout=10, headers={"User-Agent": "Mozilla/5.0"}, verify=False)
                 if resp.status_code != 200:
-                    return None, ""
+                    return None, []
                 t = resp.text.strip()
                 rs = list(csv.reader(io.StringIO(t)))
                 if len(rs) <= 1:
-                    return None, ""
+                    return None, []
                 hdr = [h.strip().lower() for h in rs[0]]
                 try:
                     i_date = hdr.index("date")
                     i_close = hdr.index("close")
                 except ValueError:
-                    return None, ""
+                    return None, []
                 flt = []
+                ds = []
                 s_dt = datetime.fromisoformat(start)
                 e_dt = datetime.fromisoformat(end)
                 if s_dt > e_dt:
                     s_dt, e_dt = e_dt, s_dt
-                ld = ""
                 for rr in rs[1:]:
                     try:
                         d = datetime.fromisoformat(rr[i_date])
@@ -176,36 +312,41 @@ def predict(ticker: str, start: str = "", end: str = ""):
                         continue
                     if d >= s_dt and d <= e_dt:
                         flt.append(c)
-                        ld = d.date().isoformat()
+                        ds.append(d.date().isoformat())
                 if not flt:
-                    return None, ""
-                return np.array(flt, dtype=np.float32), ld
-            c1, ld1 = _stooq_fetch(ticker.lower())
+                    return None, []
+                return np.array(flt, dtype=np.float32), ds
+            c1, ds1 = _stooq_fetch(ticker.lower())
             if c1 is None or len(c1) == 0:
-                c2, ld2 = _stooq_fetch(f"{ticker.lower()}.us")
+                c2, ds2 = _stooq_fetch(f"{ticker.lower()}.us")
                 if c2 is not None and len(c2) > 0:
                     closes = c2
-                    last_date = ld2
+                    dates = ds2
+                    last_date = ds2[-1]
                     source = "stooq"
                 else:
                     closes = None
             else:
                 closes = c1
-                last_date = ld1
+                dates = ds1
+                last_date = ds1[-1]
                 source = "stooq"
         if closes is None or len(closes) == 0:
             return {"error": "no_data"}
         closes = np.array(closes, dtype=np.float32)
         if len(closes) > 500:
             closes = closes[-500:]
-        res = infer_from_closes(closes)
+            dates = dates[-500:] if dates is not None else None
+        with stage("infer"):
+            res = infer_from_closes(closes, key=ticker.upper(), deadline_ms=deadline_ms, ensemble=ensemble, dates=dates)
         res.update({"symbol": ticker.upper(), "date": last_date or end, "source": source or "", "points": int(len(closes))})
         return res
     except Exception:
+        log.exception("predict failed for %s", ticker)
         return {"direction": "DOWN", "confidence": 50, "symbol": ticker.upper(), "date": end or "", "source": "", "points": 0}
 
 @app.post("/predict-file")
-async def predict_file(file: UploadFile = File(...)):
+async def predict_file(file: UploadFile = File(...), deadline_ms: float = None, ensemble: bool = False):
     content = await file.read()
     f = io.StringIO(content.decode("utf-8"))
     reader = csv.reader(f)
@@ -226,7 +367,8 @@ async def predict_file(file: UploadFile = File(...)):
             continue
     if not closes:
         return {"error": "no_data"}
-    res = infer_from_closes(np.array(closes))
+    with stage("infer"):
+        res = infer_from_closes(np.array(closes), deadline_ms=deadline_ms, ensemble=ensemble)
     res.update({"symbol": file.filename, "date": ""})
     return res
 
@@ -235,40 +377,47 @@ def pd_timestamp(date_str):
     return datetime.fromisoformat(date_str).timestamp()
 
 @app.get("/ohlc")
-def ohlc(ticker: str, start: str = "", end: str = ""):
+def ohlc(ticker: str, start: str = "", end: str = "", interval: str = "1d", max_points: int = 0, downsample: str = "ohlc"):
     from datetime import datetime, timedelta
+    if interval not in OHLC_INTERVALS:
+        return {"error": "bad_interval", "rows": []}
+    intraday = interval in OHLC_INTRADAY
+    # Weekly and monthly bars are aggregated from daily bars here; only intraday goes upstream as-is.
+    upstream = interval if intraday else "1d"
     try:
         if not end:
             end = datetime.utcnow().date().isoformat()
         if not start:
-            start = (datetime.utcnow().date() - timedelta(days=365)).isoformat()
+            if intraday:
+                # Longest range Yahoo serves for the interval, counted back from end.
+                start = (datetime.fromisoformat(end) - timedelta(days=OHLC_INTRADAY_MAX_DAYS[interval])).date().isoformat()
+            else:
+                start = (datetime.utcnow().date() - timedelta(days=365)).isoformat()
+        if datetime.fromisoformat(start) > datetime.fromisoformat(end):
+            start, end = end, start
+        if intraday:
+            # Yahoo rejects intraday ranges past its per-interval limit, so clamp instead of returning no data.
+            earliest = datetime.fromisoformat(end) - timedelta(days=OHLC_INTRADAY_MAX_DAYS[interval])
+            if datetime.fromisoformat(start) < earliest:
+                start = earliest.date().isoformat()
         try:
-            df = yf.download(ticker, start=start, end=end, progress=False)
+            with stage("fetch.yfinance"):
+                df = yf.download(ticker, start=start, end=end, interval=upstream, progress=False)
         except Exception:
             df = None
-        rows = []
-        if df is not None and not df.empty:
-            for idx, r in df.iterrows():
-                try:
-                    d = str(idx.date())
-                    o = float(r["Open"]) if r["Open"] == r["Open"] else None
-                    h = float(r["High"]) if r["High"] == r["High"] else None
-                    l = float(r["Low"]) if r["Low"] == r["Low"] else None
-                    c = float(r["Close"]) if r["Close"] == r["Close"] else None
-                    v = int(r["Volume"]) if r["Volume"] == r["Volume"] else 0
-                    if None not in (o, h, l, c):
-                        rows.append({"time": d, "open": o, "high": h, "low": l, "close": c, "volume": v})
-                except Exception:
-                    continue
-        if not rows:
+        with stage("parse"):
+            frame = frame_from_download(df)
+        if frame.empty:
             s_dt = datetime.fromisoformat(start)
             e_dt = datetime.fromisoformat(end)
             if s_dt > e_dt:
                 s_dt, e_dt = e_dt, s_dt
             p1 = int(s_dt.timestamp())
             p2 = int(e_dt.timestamp())
-            url = f"https://query1.finance.yahoo.com/v8/finance/chart/{ticker}?period1={p1}&period2={p2}&interval=1d&includePrePost=false"
-            r = requests.get(url, timeout=10, headers={"User-Agent": "Mozilla/5.0"}, verify=False)
+            rows = []
+            url = f"https://query1.finance.yahoo.com/v8/finance/chart/{ticker}?period1={p1}&period2={p2}&interval={upstream}&includePrePost=false"
+            with stage("fetch.yahoo_chart"):
+                r = requests.get(url, timeout=10, headers={"User-Agent": "Mozilla/5.0"}, verify=False)
             if r.status_code == 200:
                 j = r.json()
                 result = (j.get("chart", {}).get("result") or [None])[0]
@@ -282,15 +431,20 @@ def ohlc(ticker: str, start: str = "", end: str = ""):
                 vols = q0.get("volume") or []
                 for i in range(min(len(ts), len(closes))):
                     try:
-                        d = datetime.utcfromtimestamp(int(ts[i])).date().isoformat()
+                        t = datetime.utcfromtimestamp(int(ts[i]))
+                        d = t.isoformat() if intraday else t.date().isoformat()
                         o = opens[i]; h = highs[i]; l = lows[i]; c = closes[i]; v = vols[i] or 0
                         if None not in (o, h, l, c):
                             rows.append({"time": d, "open": float(o), "high": float(h), "low": float(l), "close": float(c), "volume": int(v)})
                     except Exception:
                         continue
-        if not rows:
+            with stage("parse"):
+                frame = frame_from_rows(rows)
+        if frame.empty and not intraday:
+            rows = []
             u = f"https://stooq.com/q/d/l/?s={ticker.lower()}&i=d"
-            resp = requests.get(u, timeout=10, headers={"User-Agent": "Mozilla/5.0"}, verify=False)
+            with stage("fetch.stooq"):
+                resp = requests.get(u, timeout=10, headers={"User-Agent": "Mozilla/5.0"}, verify=False)
             if resp.status_code == 200:
                 t = resp.text.strip()
                 rs = list(csv.reader(io.StringIO(t)))
@@ -307,7 +461,8 @@ def ohlc(ticker: str, start: str = "", end: str = ""):
                     pass
             if not rows:
                 u2 = f"https://stooq.com/q/d/l/?s={ticker.lower()}.us&i=d"
-                resp2 = requests.get(u2, timeout=10, headers={"User-Agent": "Mozilla/5.0"}, verify=False)
+                with stage("fetch.stooq.us"):
+                    resp2 = requests.get(u2, timeout=10, headers={"User-Agent": "Mozilla/5.0"}, verify=False)
                 if resp2.status_code == 200:
                     t2 = resp2.text.strip()
                     rs2 = list(csv.reader(io.StringIO(t2)))
@@ -322,13 +477,23 @@ def ohlc(ticker: str, start: str = "", end: str = ""):
                                 continue
                     except Exception:
                         pass
-        if not rows:
+            with stage("parse"):
+                frame = frame_from_rows(rows)
+        if frame.empty:
             return {"error": "no_data", "rows": []}
         s_dt = datetime.fromisoformat(start)
         e_dt = datetime.fromisoformat(end)
         if s_dt > e_dt:
             s_dt, e_dt = e_dt, s_dt
-        filt = [r for r in rows if s_dt <= datetime.fromisoformat(r["time"]) <= e_dt]
-        return {"rows": filt if filt else rows}
+        with stage("aggregate"):
+            day = frame["time"].dt.normalize()
+            filt = frame[(day >= s_dt) & (day <= e_dt)]
+            frame = filt if len(filt) else frame
+            frame = resample_ohlcv(frame, interval)
+            total = len(frame)
+            frame = downsample_ohlcv(frame, max_points, downsample)
+            rows = ohlc_rows(frame, interval)
+        return {"rows": rows, "interval": interval, "points": len(rows), "total": total}
     except Exception:
-        return {"error": "service_unavailable", "rows": []}
\ No newline at end of file
+        log.exception("ohlc failed for %s", ticker)
+        return {"error": "service_unavailable", "rows": []}
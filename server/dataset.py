@@ -0,0 +1,100 @@
+import os
+import hashlib
+import numpy as np
+import pandas as pd
+import yfinance as yf
+from numpy.lib.stride_tricks import sliding_window_view
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CACHE_DIR = os.path.join(ROOT, ".cache", "datasets")
+
+def _as_tickers(tickers):
+    if isinstance(tickers, str):
+        tickers = [tickers]
+    return sorted({t.strip().upper() for t in tickers if t and t.strip()})
+
+def fetch_closes_many(tickers, start, end):
+    # One pooled download for the whole ticker set instead of one call per ticker.
+    tickers = _as_tickers(tickers)
+    if not tickers:
+        return {}
+    df = yf.download(tickers, start=start, end=end, progress=False, group_by="column", threads=True)
+    if df is None or df.empty:
+        return {}
+    close = df["Close"]
+    if isinstance(close, pd.Series):
+        close = close.to_frame(tickers[0])
+    out = {}
+    for t in tickers:
+        if t not in close.columns:
+            continue
+        vals = close[t].dropna().values.astype(np.float32)
+        if len(vals):
+            out[t] = vals
+    return out
+
+def make_windows(series, window):
+    # Windows never straddle two tickers: every series is laid end to end and a
+    # window of window+2 bars (inputs, current, next) is kept only if its first
+    # and last bars belong to the same series.
+    # Also returns, per row, the index of the series it came from; rows stay in time order within a series.
+    series = [np.asarray(s, dtype=np.float32) for s in series if len(s) >= window + 2]
+    if not series:
+        return np.zeros((0, window), dtype=np.float32), np.zeros((0, 1), dtype=np.float32), np.zeros(0, dtype=np.int32)
+    flat = np.concatenate(series)
+    seg = np.repeat(np.arange(len(series)), [len(s) for s in series])
+    span = window + 2
+    views = sliding_window_view(flat, span)
+    valid = seg[:len(flat) - span + 1] == seg[span - 1:]
+    views = views[valid]
+    X = np.ascontiguousarray(views[:, :window])
+    y = (views[:, window + 1] >= views[:, window]).astype(np.float32).reshape(-1, 1)
+    groups = seg[:len(flat) - span + 1][valid].astype(np.int32)
+    return X, y, groups
+
+def train_val_split(X, y, groups=None, frac=0.8):
+    # Chronological split inside every ticker: the first frac of each ticker's windows train,
+    # the rest validate, so every ticker is represented on both sides.
+    if groups is None:
+        groups = np.zeros(len(X), dtype=np.int32)
+    groups = np.asarray(groups)
+    pos = np.zeros(len(groups), dtype=np.int64)
+    counts = np.zeros(len(groups), dtype=np.int64)
+    for g in np.unique(groups):
+        idx = np.flatnonzero(groups == g)
+        pos[idx] = np.arange(len(idx))
+        counts[idx] = len(idx)
+    train = pos < (counts * frac).astype(np.int64)
+    return X[train], y[train], X[~train], y[~train]
+
+def normalize_windows(X):
+    X = np.asarray(X, dtype=np.float32)
+    m = X.mean(axis=-1, keepdims=True)
+    s = X.std(axis=-1, keepdims=True)
+    s[s == 0] = 1.0
+    return (X - m) / s
+
+def _cache_path(tickers, start, end, window, normalize, cache_dir):
+    key = f"{','.join(tickers)}|{start}|{end}|{window}|{int(bool(normalize))}"
+    digest = hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+    return os.path.join(cache_dir, f"ds_{window}_{digest}.npz")
+
+def build_dataset(tickers, start, end, window=8, normalize=False, cache_dir=CACHE_DIR, refresh=False):
+    tickers = _as_tickers(tickers)
+    path = _cache_path(tickers, start, end, window, normalize, cache_dir) if cache_dir else None
+    if path and not refresh and os.path.exists(path):
+        try:
+            npz = np.load(path)
+            return npz["X"], npz["y"], npz["groups"]
+        except Exception:
+            pass
+    closes = fetch_closes_many(tickers, start, end)
+    X, y, groups = make_windows([closes[t] for t in tickers if t in closes], window)
+    if normalize:
+        X = normalize_windows(X)
+    if path and len(X):
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp = path + ".tmp.npz"
+        np.savez(tmp, X=X, y=y, groups=groups)
+        os.replace(tmp, path)
+    return X, y, groups
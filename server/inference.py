@@ -0,0 +1,94 @@
+import os
+import time
+import logging
+import threading
+import contextvars
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from server.profiling import traced_thread
+
+log = logging.getLogger("server.inference")
+
+DEADLINE_MS = float(os.environ.get("INFER_DEADLINE_MS", "1500"))
+_pool = ThreadPoolExecutor(max_workers=int(os.environ.get("INFER_WORKERS", "8")), thread_name_prefix="infer")
+# Running calls allowed per model across all requests. Futures cannot be cancelled once started,
+# so a model that overruns its deadline keeps its worker; past this many it is skipped ("busy")
+# instead of queueing more work and starving the other models of the shared pool.
+MAX_INFLIGHT = int(os.environ.get("INFER_MAX_INFLIGHT", "2"))
+_inflight = Counter()
+_inflight_lock = threading.Lock()
+
+def _acquire(name):
+    with _inflight_lock:
+        if _inflight[name] >= MAX_INFLIGHT:
+            return False
+        _inflight[name] += 1
+        return True
+
+def _release(name):
+    with _inflight_lock:
+        _inflight[name] -= 1
+
+def _timed(name, fn):
+    t0 = time.perf_counter()
+    try:
+        with traced_thread():
+            prob = fn()
+        status = "ok" if prob is not None else "skipped"
+    except Exception:
+        log.warning("%s inference failed", name, exc_info=True)
+        prob, status = None, "error"
+    return prob, status, (time.perf_counter() - t0) * 1000.0
+
+def run_cascade(candidates, deadline_ms=None, ensemble=False):
+    # candidates: [(name, fn)] in priority order, fn() -> probability of UP or None when it cannot answer.
+    # All start at once; without ensemble the highest-priority model that answers within the
+    # deadline wins, and we return as soon as nothing ranked above the current best is still running.
+    # Returns (name or None, prob or None, {name: {"status", "ms"}}).
+    deadline_ms = DEADLINE_MS if deadline_ms is None else deadline_ms
+    t0 = time.perf_counter()
+    futs = []
+    timings = {}
+    for name, fn in candidates:
+        if not _acquire(name):
+            timings[name] = {"status": "busy", "ms": None}
+            continue
+        f = _pool.submit(contextvars.copy_context().run, _timed, name, fn)
+        f.add_done_callback(lambda _, name=name: _release(name))
+        futs.append((name, f))
+    pending = {f for _, f in futs}
+    while pending:
+        remaining = deadline_ms / 1000.0 - (time.perf_counter() - t0)
+        if remaining <= 0:
+            break
+        _, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+        if ensemble:
+            continue
+        decided = False
+        for _, f in futs:
+            if not f.done():
+                break
+            if f.result()[0] is not None:
+                decided = True
+                break
+        if decided:
+            break
+    expired = (time.perf_counter() - t0) * 1000.0 >= deadline_ms
+    answers = []
+    for name, f in futs:
+        if not f.done():
+            # Still queued or running: it missed the deadline, or a higher-ranked model already
+            # answered. Only queued calls can be cancelled; running ones finish in the background.
+            f.cancel()
+            timings[name] = {"status": "timeout" if expired else "superseded", "ms": None}
+            continue
+        prob, status, ms = f.result()
+        timings[name] = {"status": status, "ms": round(ms, 3)}
+        if prob is not None:
+            answers.append((name, float(prob)))
+    timings = {name: timings[name] for name, _ in candidates}
+    if not answers:
+        return None, None, timings
+    if ensemble and len(answers) > 1:
+        return "ensemble", sum(p for _, p in answers) / len(answers), timings
+    return answers[0][0], answers[0][1], timings
@@ -0,0 +1,124 @@
+import numpy as np
+import pandas as pd
+
+INTRADAY = {"1m", "2m", "5m", "15m", "30m", "60m", "90m", "1h"}
+AGGREGATED = {"1wk": "W", "1mo": "M"}
+INTERVALS = INTRADAY | set(AGGREGATED) | {"1d"}
+COLUMNS = ["time", "open", "high", "low", "close", "volume"]
+# Longest range Yahoo serves per intraday interval, in days.
+INTRADAY_MAX_DAYS = {"1m": 7, "2m": 59, "5m": 59, "15m": 59, "30m": 59, "90m": 59, "60m": 729, "1h": 729}
+
+def frame_from_download(df):
+    if df is None or df.empty:
+        return empty_frame()
+    if isinstance(df.columns, pd.MultiIndex):
+        df = df.copy()
+        df.columns = df.columns.get_level_values(0)
+    idx = pd.DatetimeIndex(df.index)
+    if idx.tz is not None:
+        idx = idx.tz_convert("UTC").tz_localize(None)
+    frame = pd.DataFrame({
+        "time": idx,
+        "open": df["Open"].to_numpy(dtype=np.float64),
+        "high": df["High"].to_numpy(dtype=np.float64),
+        "low": df["Low"].to_numpy(dtype=np.float64),
+        "close": df["Close"].to_numpy(dtype=np.float64),
+        "volume": df["Volume"].fillna(0).to_numpy(dtype=np.float64),
+    })
+    return clean(frame)
+
+def frame_from_rows(rows):
+    if not rows:
+        return empty_frame()
+    frame = pd.DataFrame(rows, columns=COLUMNS)
+    frame["time"] = pd.to_datetime(frame["time"], errors="coerce")
+    return clean(frame)
+
+def empty_frame():
+    return pd.DataFrame({c: pd.Series(dtype="datetime64[ns]" if c == "time" else "float64") for c in COLUMNS})
+
+def clean(frame):
+    frame = frame.dropna(subset=["time", "open", "high", "low", "close"])
+    frame = frame.drop_duplicates(subset="time", keep="last").sort_values("time")
+    frame["volume"] = frame["volume"].fillna(0)
+    return frame.reset_index(drop=True)
+
+def resample(frame, interval):
+    # Daily bars to weekly/monthly: one groupby over calendar periods, bar stamped with its first trading day.
+    rule = AGGREGATED.get(interval)
+    if rule is None or frame.empty:
+        return frame
+    key = frame["time"].dt.to_period(rule)
+    out = frame.groupby(key, sort=True).agg(
+        time=("time", "first"),
+        open=("open", "first"),
+        high=("high", "max"),
+        low=("low", "min"),
+        close=("close", "last"),
+        volume=("volume", "sum"),
+    )
+    return out.reset_index(drop=True)
+
+def bucket_ohlcv(frame, max_points):
+    # Equal-count buckets merged into one candle each: first open, max high, min low,
+    # last close, summed volume, so every extreme of the original range survives.
+    n = len(frame)
+    if max_points <= 0 or n <= max_points:
+        return frame
+    starts = np.flatnonzero(np.diff(np.arange(n) * max_points // n, prepend=-1))
+    ends = np.append(starts[1:], n) - 1
+    return pd.DataFrame({
+        "time": frame["time"].to_numpy()[starts],
+        "open": frame["open"].to_numpy()[starts],
+        "high": np.maximum.reduceat(frame["high"].to_numpy(), starts),
+        "low": np.minimum.reduceat(frame["low"].to_numpy(), starts),
+        "close": frame["close"].to_numpy()[ends],
+        "volume": np.add.reduceat(frame["volume"].to_numpy(), starts),
+    })
+
+def lttb_indices(x, y, n_out):
+    # Largest-Triangle-Three-Buckets: keeps first and last points and, per bucket,
+    # the point forming the largest triangle with the previous pick and the next bucket's mean.
+    n = len(y)
+    if n_out >= n:
+        return np.arange(n)
+    if n_out < 3:
+        # No middle buckets to choose from: keep the endpoints the budget allows.
+        return np.array([0, n - 1][:max(n_out, 0)], dtype=np.int64)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    out = np.empty(n_out, dtype=np.int64)
+    out[0] = 0
+    out[-1] = n - 1
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        nlo, nhi = hi, (edges[i + 2] if i + 2 < len(edges) else n)
+        cx = x[nlo:nhi].mean()
+        cy = y[nlo:nhi].mean()
+        area = np.abs((x[a] - cx) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (cy - y[a]))
+        a = lo + int(np.argmax(area))
+        out[i + 1] = a
+    return out
+
+def downsample(frame, max_points, method="ohlc"):
+    if max_points <= 0 or len(frame) <= max_points:
+        return frame
+    if method == "lttb":
+        x = frame["time"].to_numpy().astype("datetime64[s]").astype(np.int64)
+        idx = lttb_indices(x, frame["close"].to_numpy(), max_points)
+        return frame.iloc[idx].reset_index(drop=True)
+    return bucket_ohlcv(frame, max_points)
+
+def to_rows(frame, interval):
+    fmt = "%Y-%m-%dT%H:%M:%SZ" if interval in INTRADAY else "%Y-%m-%d"
+    out = pd.DataFrame({
+        "time": frame["time"].dt.strftime(fmt) if len(frame) else pd.Series(dtype=object),
+        "open": frame["open"].astype(float),
+        "high": frame["high"].astype(float),
+        "low": frame["low"].astype(float),
+        "close": frame["close"].astype(float),
+        "volume": frame["volume"].astype(np.int64),
+    })
+    return out.to_dict("records")
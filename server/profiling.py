@@ -0,0 +1,219 @@
+import os
+import sys
+import json
+import time
+import hmac
+import logging
+import threading
+import contextvars
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+
+log = logging.getLogger("server.profiling")
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SLOW_DIR = os.environ.get("SLOW_REQUEST_DIR", os.path.join(ROOT, ".cache", "slow_requests"))
+SLOW_MS = float(os.environ.get("SLOW_REQUEST_MS", "2000"))
+SLOW_RING = int(os.environ.get("SLOW_REQUEST_RING", "200"))
+PROFILE_TOKEN = os.environ.get("PROFILE_TOKEN", "")
+PROFILE_INTERVAL = float(os.environ.get("PROFILE_INTERVAL_MS", "5")) / 1000.0
+PROFILE_TOP = 50
+
+_current = contextvars.ContextVar("request_trace", default=None)
+
+class Sampler:
+    # Samples the Python stacks of a set of threads on a timer and counts folded stacks ("a;b;c").
+    # Threads are attached per piece of work (refcounted), so a pool thread is only sampled
+    # while it runs this request's work.
+    def __init__(self, interval=PROFILE_INTERVAL):
+        self.interval = interval
+        self.counts = Counter()
+        self.samples = 0
+        self._threads = Counter()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="request-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join(timeout=1.0)
+
+    def attach(self, thread_id):
+        with self._lock:
+            self._threads[thread_id] += 1
+
+    def detach(self, thread_id):
+        with self._lock:
+            self._threads[thread_id] -= 1
+            if self._threads[thread_id] <= 0:
+                del self._threads[thread_id]
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            with self._lock:
+                ids = list(self._threads)
+            frames = sys._current_frames()
+            for tid in ids:
+                frame = frames.get(tid)
+                if frame is None:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+                    frame = frame.f_back
+                self.counts[";".join(reversed(stack))] += 1
+                self.samples += 1
+
+    def report(self, top=PROFILE_TOP):
+        return {
+            "interval_ms": self.interval * 1000.0,
+            "samples": self.samples,
+            "stacks": [{"stack": s, "count": c} for s, c in self.counts.most_common(top)],
+        }
+
+class RequestTrace:
+    def __init__(self, method, path, query, profile=False):
+        self.method = method
+        self.path = path
+        self.query = query
+        self.profile = profile
+        self.stages = []
+        self.sampler = None
+        self.t0 = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def bind_thread(self, pin=True):
+        # Endpoints run in the threadpool, so the sampler starts on whichever thread reaches
+        # the first stage and keeps sampling it until the request ends. Work handed to other
+        # threads is added with traced_thread().
+        if not self.profile:
+            return None
+        with self._lock:
+            if self.sampler is None:
+                self.sampler = Sampler()
+                if pin:
+                    self.sampler.attach(threading.get_ident())
+                self.sampler.start()
+        return self.sampler
+
+    def finish(self):
+        if self.sampler is not None:
+            self.sampler.stop()
+        return (time.perf_counter() - self.t0) * 1000.0
+
+    def summary(self, total_ms, status):
+        return {
+            "time": datetime.utcnow().isoformat() + "Z",
+            "method": self.method,
+            "path": self.path,
+            "query": self.query,
+            "status": status,
+            "total_ms": round(total_ms, 3),
+            "stages": self.stages,
+        }
+
+@contextmanager
+def stage(name):
+    tr = _current.get()
+    if tr is None:
+        yield
+        return
+    tr.bind_thread()
+    t0 = time.perf_counter()
+    err = None
+    try:
+        yield
+    except Exception as e:
+        err = repr(e)
+        log.debug("stage %s failed: %s", name, err)
+        raise
+    finally:
+        rec = {"stage": name, "ms": round((time.perf_counter() - t0) * 1000.0, 3)}
+        if err is not None:
+            rec["error"] = err
+        tr.stages.append(rec)
+
+@contextmanager
+def traced_thread():
+    # Samples the calling thread while the block runs; wrap work that a request submits to
+    # another thread (run under a copy of the request's context).
+    tr = _current.get()
+    sampler = tr.bind_thread(pin=False) if tr is not None else None
+    if sampler is None:
+        yield
+        return
+    tid = threading.get_ident()
+    sampler.attach(tid)
+    try:
+        yield
+    finally:
+        sampler.detach(tid)
+
+def start_trace(method, path, query, profile=False):
+    if SLOW_MS <= 0 and not profile:
+        return None, None
+    tr = RequestTrace(method, path, query, profile)
+    return tr, _current.set(tr)
+
+def end_trace(token):
+    if token is not None:
+        _current.reset(token)
+
+def profile_requested(headers, query_params):
+    flag = headers.get("x-profile") or query_params.get("profile") or ""
+    if flag.lower() not in ("1", "true", "yes"):
+        return False
+    if not PROFILE_TOKEN:
+        return False
+    return hmac.compare_digest(headers.get("x-profile-token", ""), PROFILE_TOKEN)
+
+class SlowRequestRing:
+    # Fixed number of slot files overwritten round-robin, so disk use stays bounded.
+    def __init__(self, directory=SLOW_DIR, size=SLOW_RING):
+        self.directory = directory
+        self.size = max(1, size)
+        self._lock = threading.Lock()
+        self._next = None
+
+    def _slot(self, i):
+        return os.path.join(self.directory, f"slow_{i:04d}.json")
+
+    def _init_next(self):
+        os.makedirs(self.directory, exist_ok=True)
+        newest, newest_mtime = -1, -1.0
+        for i in range(self.size):
+            try:
+                m = os.path.getmtime(self._slot(i))
+            except OSError:
+                continue
+            if m > newest_mtime:
+                newest, newest_mtime = i, m
+        self._next = (newest + 1) % self.size
+
+    def record(self, entry):
+        with self._lock:
+            try:
+                if self._next is None:
+                    self._init_next()
+                path = self._slot(self._next)
+                self._next = (self._next + 1) % self.size
+                tmp = path + ".tmp"
+                with open(tmp, "w") as f:
+                    json.dump(entry, f)
+                os.replace(tmp, path)
+            except Exception as e:
+                log.warning("could not record slow request: %r", e)
+
+slow_ring = SlowRequestRing()
+
+def record_if_slow(tr, total_ms, status):
+    if SLOW_MS > 0 and total_ms >= SLOW_MS:
+        entry = tr.summary(total_ms, status)
+        log.warning("slow request %s %s %.0fms %s", tr.method, tr.path, total_ms, [(s["stage"], s["ms"]) for s in tr.stages])
+        slow_ring.record(entry)
@@ -0,0 +1,155 @@
+import os
+import sys
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import nullcontext
+import numpy as np
+
+log = logging.getLogger("server.recurrent")
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HISTORY = 512      # processed bars kept per ticker to check for revised history
+MAX_TICKERS = 256
+
+def save_checkpoint(path, model, mean=0.0, std=1.0, target_mean=0.0, target_std=1.0, version=None):
+    # Checkpoint format loaded by RecurrentModel: a close-price QShallowRegressionLSTM plus the
+    # normalization it was trained with (notebook-style per-column z-scores).
+    import torch
+    torch.save({
+        "state_dict": model.state_dict(),
+        "num_sensors": int(model.num_sensors),
+        "hidden_units": int(model.hidden_units),
+        "n_qubits": int(model.lstm.n_qubits),
+        "n_qlayers": int(model.lstm.n_qlayers),
+        "features": ["Close"],
+        "mean": float(mean),
+        "std": float(std),
+        "target_mean": float(target_mean),
+        "target_std": float(target_std),
+        "version": version,
+    }, path)
+
+class RecurrentModel:
+    # Serves a QShallowRegressionLSTM checkpoint and keeps, per ticker, the (h_t, c_t) reached after
+    # the last processed bar so a request that adds one bar costs one cell step.
+    def __init__(self, path):
+        self.path = path
+        self.model = None
+        self.cfg = None
+        self.version = None
+        self._mtime = None
+        # _lock guards loading and the cache only; forwards run outside it so one ticker's cold
+        # replay does not stall every other ticker. _key_locks stops two requests for the same
+        # ticker from replaying it at once.
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()
+        self._key_locks = {}
+
+    def _load_if_changed(self):
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            self.model = None
+            return False
+        if mtime == self._mtime:
+            return self.model is not None
+        self._mtime = mtime
+        try:
+            import torch
+            if ROOT not in sys.path:
+                sys.path.insert(0, ROOT)
+            from QLSTM.Factory import QShallowRegressionLSTM
+            ckpt = torch.load(self.path, map_location="cpu")
+            if list(ckpt.get("features", ["Close"])) != ["Close"] or int(ckpt["num_sensors"]) != 1:
+                raise ValueError("only close-price checkpoints can be served")
+            m = QShallowRegressionLSTM(num_sensors=1, hidden_units=int(ckpt["hidden_units"]), n_qubits=int(ckpt["n_qubits"]), n_qlayers=int(ckpt.get("n_qlayers", 1)))
+            m.load_state_dict(ckpt["state_dict"])
+            m.eval()
+            self.model = m
+            self.cfg = ckpt
+            self.version = str(ckpt.get("version") or mtime)
+        except Exception:
+            log.warning("could not load %s", self.path, exc_info=True)
+            self.model = None
+        # A new checkpoint makes every cached state stale.
+        self._cache.clear()
+        return self.model is not None
+
+    def _resume_point(self, entry, arr, dates, version):
+        # Number of leading bars of arr already folded into entry's state, or None if the cached
+        # series does not end inside arr or any overlapping bar was revised. Anchored on bar dates:
+        # the bars after the cached last date are new, and the ones before must end exactly where
+        # the cached series ended (closes alone are ambiguous, e.g. a halted stock's flat prices).
+        if entry is None or entry["version"] != version or dates is None:
+            return None
+        seen, seen_dates = entry["closes"], entry["dates"]
+        p = len(arr) - int(np.sum(dates > seen_dates[-1]))
+        if p <= 0 or dates[p - 1] != seen_dates[-1]:
+            return None
+        overlap = min(p, len(seen))
+        if not np.array_equal(dates[p - overlap:p], seen_dates[-overlap:]):
+            return None
+        if not np.allclose(arr[p - overlap:p], seen[-overlap:], rtol=1e-6, atol=0.0):
+            return None
+        return p
+
+    def _run(self, model, cfg, x, state):
+        import torch
+        xs = (np.asarray(x, dtype=np.float32) - cfg["mean"]) / (cfg["std"] or 1.0)
+        t = torch.from_numpy(xs.reshape(1, -1, 1))
+        with torch.no_grad():
+            out, (h, c) = model.forward_state(t, state)
+        return float(out[0]) * (cfg["target_std"] or 1.0) + cfg["target_mean"], (h.detach(), c.detach())
+
+    def predict(self, closes, key=None, dates=None):
+        # dates: one sortable label per bar (e.g. ISO dates); state is only cached per key when given.
+        arr = np.asarray(closes, dtype=np.float32)
+        if len(arr) == 0:
+            return None
+        if dates is not None:
+            dates = np.asarray(dates).astype(str)
+            if len(dates) != len(arr):
+                raise ValueError("dates and closes differ in length")
+        cache = key is not None and dates is not None
+        with self._lock:
+            if not self._load_if_changed():
+                return None
+            model, cfg, version = self.model, self.cfg, self.version
+            key_lock = self._key_locks.setdefault(key, threading.Lock()) if cache else None
+        with key_lock or nullcontext():
+            with self._lock:
+                entry = self._cache.get(key) if cache else None
+            p = self._resume_point(entry, arr, dates, version)
+            if p is None:
+                pred, state = self._run(model, cfg, arr, None)
+                steps = len(arr)
+            elif p == len(arr):
+                pred, state = entry["pred"], entry["state"]
+                steps = 0
+            else:
+                pred, state = self._run(model, cfg, arr[p:], entry["state"])
+                steps = len(arr) - p
+            if cache:
+                if p is None:
+                    seen, seen_dates = arr[-HISTORY:].copy(), dates[-HISTORY:].copy()
+                else:
+                    seen = np.concatenate([entry["closes"], arr[p:]])[-HISTORY:]
+                    seen_dates = np.concatenate([entry["dates"], dates[p:]])[-HISTORY:]
+                with self._lock:
+                    # Not cached if another checkpoint was loaded while this one ran: the state is stale.
+                    if self.model is model and self.version == version:
+                        self._cache[key] = {"version": version, "closes": seen, "dates": seen_dates, "state": state, "pred": pred}
+                        self._cache.move_to_end(key)
+                    while len(self._cache) > MAX_TICKERS:
+                        evicted, _ = self._cache.popitem(last=False)
+                        self._key_locks.pop(evicted, None)
+                    if len(self._key_locks) > 2 * MAX_TICKERS:
+                        # keys whose state was dropped by a checkpoint reload
+                        self._key_locks = {k: v for k, v in self._key_locks.items() if k in self._cache or v.locked()}
+        last = float(arr[-1])
+        change = (pred - last) / last if last else 0.0
+        # Same 55-95 confidence band as the SMA fallback, driven by the predicted move.
+        conf = min(95.0, max(55.0, abs(change) * 100)) / 100.0
+        prob = conf if pred >= last else 1.0 - conf
+        return {"prob": prob, "prediction": pred, "steps": steps}
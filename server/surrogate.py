@@ -0,0 +1,67 @@
+import logging
+import numpy as np
+
+log = logging.getLogger("server.surrogate")
+
+# Each input enters the circuit through one RX(x) rotation, so <Z0> is a trigonometric polynomial
+# with frequencies {-1, 0, 1} per input: a linear combination of the 3^d products of [1, cos x_i, sin x_i].
+GRID = np.array([0.0, 2.0 * np.pi / 3.0, 4.0 * np.pi / 3.0])
+_B = np.stack([np.ones(3), np.cos(GRID), np.sin(GRID)], axis=1)
+_B_INV = np.linalg.inv(_B)
+MAX_DIMS = 8              # 3^8 grid points and 52 KB feature rows; beyond that keep the circuit
+FEATURE_BYTES = 64 << 20  # float64 feature matrix allowed per evaluation chunk
+FIT_BATCH = 4096          # grid points per circuit call while fitting
+
+def _basis(x):
+    return np.stack([np.ones_like(x), np.cos(x), np.sin(x)], axis=-1)
+
+def features(X):
+    # Row-wise Kronecker product of the per-input bases, wire 0 outermost: (N, d) -> (N, 3^d).
+    X = np.asarray(X, dtype=np.float64)
+    F = _basis(X[:, 0])
+    for i in range(1, X.shape[1]):
+        F = (F[:, :, None] * _basis(X[:, i])[:, None, :]).reshape(len(X), -1)
+    return F
+
+def chunk_rows(dims):
+    return max(1, FEATURE_BYTES // (8 * 3 ** dims))
+
+def fit_coefficients(fn, dims):
+    # Sampling fn on the 3-point grid per input determines the coefficients exactly:
+    # the samples are the coefficient tensor with _B applied along every axis.
+    # fn gets FIT_BATCH rows at a time and should run them as one batch (e.g. PennyLane
+    # parameter broadcasting); 3^d separate circuit runs would hold up server startup.
+    grid = np.stack(np.meshgrid(*([GRID] * dims), indexing="ij"), axis=-1).reshape(-1, dims)
+    vals = [np.asarray(fn(grid[i:i + FIT_BATCH]), dtype=np.float64).reshape(-1) for i in range(0, len(grid), FIT_BATCH)]
+    T = np.concatenate(vals).reshape((3,) * dims)
+    for axis in range(dims):
+        T = np.moveaxis(np.tensordot(_B_INV, T, axes=([1], [axis])), 0, axis)
+    return T.reshape(-1)
+
+class TrigSurrogate:
+    def __init__(self, coeffs, dims):
+        self.coeffs = coeffs
+        self.dims = dims
+
+    def __call__(self, X):
+        X = np.asarray(X, dtype=np.float64)[:, :self.dims]
+        out = np.empty(len(X), dtype=np.float64)
+        # rows per chunk sized so the (rows, 3^d) feature matrix stays within FEATURE_BYTES
+        n = chunk_rows(self.dims)
+        for i in range(0, len(X), n):
+            out[i:i + n] = features(X[i:i + n]) @ self.coeffs
+        return out
+
+def compile_circuit(fn, dims, n_check=64, atol=1e-6, seed=0):
+    # fn maps an (N, dims) array of input angles to the N circuit outputs. Returns None (and the
+    # caller keeps using the circuit) when the surrogate does not reproduce it on random inputs.
+    if dims < 1 or dims > MAX_DIMS:
+        log.info("not compiling a %d-input circuit", dims)
+        return None
+    surrogate = TrigSurrogate(fit_coefficients(fn, dims), dims)
+    X = np.random.default_rng(seed).uniform(-np.pi, np.pi, size=(n_check, dims))
+    err = float(np.max(np.abs(surrogate(X) - np.asarray(fn(X), dtype=np.float64))))
+    if err > atol:
+        log.warning("surrogate rejected: max error %.3g on %d random inputs", err, n_check)
+        return None
+    return surrogate
@@ -0,0 +1,155 @@
+import os
+import json
+import math
+import time
+import shutil
+import random
+import argparse
+import itertools
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timedelta
+from dataset import build_dataset, ROOT
+
+SWEEP_DIR = os.path.join(ROOT, ".cache", "sweeps")
+
+DEFAULT_SPACE = {
+    "vqc": {
+        "window": [4, 8, 12],
+        "wires": [2, 4, 6],
+        "layers": [1, 2, 3],
+        "lr": [0.005, 0.01, 0.05],
+        "epochs": [3, 6, 12],
+    },
+    "mlp": {
+        "window": [10, 20, 40],
+        "lr": [0.0005, 0.001, 0.005],
+        "epochs": [10, 20, 40],
+    },
+}
+
+def sample_configs(space, n_trials=None, seed=0):
+    keys = list(space)
+    grid = [dict(zip(keys, vals)) for vals in itertools.product(*(space[k] for k in keys))]
+    if n_trials and n_trials < len(grid):
+        grid = random.Random(seed).sample(grid, n_trials)
+    return grid
+
+def _init_worker():
+    # One process per core: keep each worker's TensorFlow single-threaded so trials don't oversubscribe.
+    os.environ.setdefault("TF_CPP_MIN_LOG_LEVEL", "2")
+    import tensorflow as tf
+    tf.config.threading.set_intra_op_parallelism_threads(1)
+    tf.config.threading.set_inter_op_parallelism_threads(1)
+
+def run_trial(kind, trial_id, rung, cfg, epochs, data, out_dir, seed):
+    t0 = time.perf_counter()
+    X, y, groups = build_dataset(data["tickers"], data["start"], data["end"], window=cfg["window"], normalize=(kind == "vqc"))
+    rec = {"trial": trial_id, "rung": rung, "config": cfg, "epochs": epochs}
+    if kind == "vqc":
+        from train_qlstm import fit
+        weights, metrics = fit(X, y, groups, wires=cfg["wires"], layers=cfg["layers"], lr=cfg["lr"], epochs=epochs, seed=seed)
+        rec["weights"] = weights.tolist()
+    else:
+        from train import fit
+        m, metrics = fit(X, y, groups, lr=cfg["lr"], epochs=epochs, verbose=0)
+        path = os.path.join(out_dir, f"trial_{trial_id}_r{rung}.keras")
+        m.save(path)
+        rec["artifact"] = path
+    rec["metrics"] = metrics
+    rec["seconds"] = time.perf_counter() - t0
+    return rec
+
+def _score(rec, metric):
+    v = rec["metrics"].get(metric)
+    if v is None:
+        return math.inf
+    return v if metric.endswith("loss") else -v
+
+def successive_halving(kind, configs, data, eta=3, workers=None, metric="val_loss", out_dir=None, seed=0, log=print):
+    workers = workers or os.cpu_count() or 1
+    out_dir = out_dir or SWEEP_DIR
+    os.makedirs(out_dir, exist_ok=True)
+    # Fetch and window once in the parent so every worker hits the on-disk dataset cache.
+    for w in sorted({c["window"] for c in configs}):
+        build_dataset(data["tickers"], data["start"], data["end"], window=w, normalize=(kind == "vqc"))
+    # One rung per power of eta that fits in the trial count (integer math: log(243, 3) is 4.999...).
+    n_rungs = 1
+    while eta ** n_rungs <= len(configs):
+        n_rungs += 1
+    alive = list(enumerate(configs))
+    history = []
+    ctx = mp.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=min(workers, len(configs)), mp_context=ctx, initializer=_init_worker) as pool:
+        for rung in range(n_rungs):
+            frac = eta ** (rung - n_rungs + 1)
+            futs = {}
+            for tid, cfg in alive:
+                epochs = max(1, int(math.ceil(cfg["epochs"] * frac)))
+                futs[pool.submit(run_trial, kind, tid, rung, cfg, epochs, data, out_dir, seed + tid)] = tid
+            results = []
+            for fut in as_completed(futs):
+                try:
+                    rec = fut.result()
+                except Exception as e:
+                    rec = {"trial": futs[fut], "rung": rung, "config": configs[futs[fut]], "metrics": {}, "error": repr(e)}
+                results.append(rec)
+                log(f"rung {rung} trial {rec['trial']} {rec.get('metrics')} {rec.get('seconds', 0):.1f}s")
+            history.extend(results)
+            results.sort(key=lambda r: _score(r, metric))
+            keep = max(1, len(results) // eta) if rung < n_rungs - 1 else len(results)
+            alive = [(r["trial"], r["config"]) for r in results[:keep] if "error" not in r]
+            if not alive:
+                break
+    final = [r for r in history if r["rung"] == history[-1]["rung"] and "error" not in r] if history else []
+    best = min(final, key=lambda r: _score(r, metric)) if final else None
+    return best, history
+
+def export_best(kind, best, out=None):
+    import numpy as np
+    if kind == "vqc":
+        from train_qlstm import save, OUT_PATH
+        cfg = best["config"]
+        save(np.array(best["weights"], dtype=np.float32), cfg["window"], cfg["wires"], cfg["layers"], out or OUT_PATH)
+        return out or OUT_PATH
+    from train import OUT_PATH
+    shutil.copyfile(best["artifact"], out or OUT_PATH)
+    return out or OUT_PATH
+
+def main():
+    ap = argparse.ArgumentParser(description="Successive-halving hyperparameter sweep for the VQC and MLP models")
+    ap.add_argument("--model", choices=["vqc", "mlp"], default="vqc")
+    ap.add_argument("--tickers", default="AAPL")
+    ap.add_argument("--years", type=float, default=2)
+    ap.add_argument("--space", help="JSON file mapping parameter name to a list of values")
+    ap.add_argument("--trials", type=int, default=0, help="random subset of the grid; 0 runs the full grid")
+    ap.add_argument("--eta", type=int, default=3)
+    ap.add_argument("--workers", type=int, default=0)
+    ap.add_argument("--metric", default="val_loss")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--no-export", action="store_true")
+    args = ap.parse_args()
+
+    space = DEFAULT_SPACE[args.model]
+    if args.space:
+        with open(args.space) as f:
+            space = json.load(f)
+    end = datetime.utcnow().date()
+    start = end - timedelta(days=int(365 * args.years))
+    data = {"tickers": [t for t in args.tickers.split(",") if t], "start": start.isoformat(), "end": end.isoformat()}
+    stamp = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
+    out_dir = os.path.join(SWEEP_DIR, f"{args.model}_{stamp}")
+
+    configs = sample_configs(space, args.trials, args.seed)
+    best, history = successive_halving(args.model, configs, data, eta=args.eta, workers=args.workers or None, metric=args.metric, out_dir=out_dir, seed=args.seed)
+    with open(os.path.join(out_dir, "trials.json"), "w") as f:
+        json.dump({"model": args.model, "data": data, "metric": args.metric, "best": best, "trials": history}, f, indent=2)
+    if best is None:
+        print("no successful trials")
+        return
+    print(f"best trial {best['trial']}: {best['config']} {best['metrics']}")
+    if not args.no_export:
+        print(f"exported {export_best(args.model, best)}")
+
+if __name__ == "__main__":
+    main()
@@ -1,52 +1,18 @@
 import os
 import numpy as np
-import yfinance as yf
 import tensorflow as tf
 import pennylane as qml
 from datetime import datetime, timedelta
+from dataset import build_dataset, train_val_split
 
-def fetch_closes(ticker, start, end):
-    df = yf.download(ticker, start=start, end=end, progress=False)
-    if df is None or df.empty:
-        return []
-    return [float(c) for c in df["Close"].dropna().values]
+OUT_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "qlstm_weights.npz")
 
-def make_dataset(closes, window=8):
-    X = []
-    y = []
-    for i in range(len(closes) - window - 1):
-        seq = closes[i:i+window]
-        cur = closes[i+window]
-        nxt = closes[i+window+1]
-        X.append(seq)
-        y.append(1 if nxt >= cur else 0)
-    X = np.array(X, dtype=np.float32)
-    y = np.array(y, dtype=np.float32).reshape(-1, 1)
-    return X, y
+def fit(X, y, groups=None, wires=4, layers=2, lr=0.01, epochs=3, seed=None):
+    if seed is not None:
+        tf.random.set_seed(seed)
+    # Same per-ticker chronological split as train.fit, so sweep metrics compare like with like.
+    Xtrain, ytrain, Xval, yval = train_val_split(X, y, groups)
 
-def preprocess(seq):
-    x = np.array(seq, dtype=np.float32)
-    m = float(np.mean(x)); s = float(np.std(x))
-    if s == 0:
-        s = 1.0
-    return (x - m) / s
-
-def train(ticker="AAPL"):
-    end = datetime.utcnow().date().isoformat()
-    start = (datetime.utcnow().date() - timedelta(days=365*2)).isoformat()
-    closes = fetch_closes(ticker, start, end)
-    window = 8
-    X, y = make_dataset(closes, window)
-    X = np.array([preprocess(x) for x in X], dtype=np.float32)
-    idx = np.arange(len(X))
-    np.random.shuffle(idx)
-    X = X[idx]; y = y[idx]
-    split = int(len(X) * 0.8)
-    Xtrain, ytrain = X[:split], y[:split]
-    Xval, yval = X[split:], y[split:]
-
-    wires = 4
-    layers = 2
     dev = qml.device("default.qubit", wires=wires)
 
     @qml.qnode(dev, interface="tf")
@@ -62,7 +28,7 @@ def train(ticker="AAPL"):
         return qml.expval(qml.PauliZ(0))
 
     weights = tf.Variable(tf.random.normal([layers, wires, 3], stddev=0.1), trainable=True, dtype=tf.float32)
-    opt = tf.keras.optimizers.Adam(0.01)
+    opt = tf.keras.optimizers.Adam(lr)
     loss_fn = tf.keras.losses.BinaryCrossentropy()
 
     def predict_prob(batch):
@@ -73,15 +39,32 @@ def train(ticker="AAPL"):
             probs.append(p)
         return tf.stack(probs)
 
-    for epoch in range(3):
+    for epoch in range(epochs):
         with tf.GradientTape() as tape:
             preds = predict_prob(tf.convert_to_tensor(Xtrain))
             loss = loss_fn(tf.convert_to_tensor(ytrain), tf.reshape(preds, (-1, 1)))
         grads = tape.gradient(loss, [weights])
         opt.apply_gradients(zip(grads, [weights]))
 
-    out = os.path.join(os.path.dirname(os.path.dirname(__file__)), "qlstm_weights.npz")
-    np.savez(out, weights=np.array(weights.numpy(), dtype=np.float32), window=np.array(window, dtype=np.int32), wires=np.array(wires, dtype=np.int32), layers=np.array(layers, dtype=np.int32))
+    metrics = {}
+    if len(Xval):
+        pv = tf.reshape(predict_prob(tf.convert_to_tensor(Xval)), (-1, 1))
+        metrics["val_loss"] = float(loss_fn(tf.convert_to_tensor(yval), pv).numpy())
+        metrics["val_accuracy"] = float(np.mean((pv.numpy() >= 0.5) == (yval >= 0.5)))
+    return np.array(weights.numpy(), dtype=np.float32), metrics
+
+def save(weights, window, wires, layers, out=OUT_PATH):
+    np.savez(out, weights=np.array(weights, dtype=np.float32), window=np.array(window, dtype=np.int32), wires=np.array(wires, dtype=np.int32), layers=np.array(layers, dtype=np.int32))
+
+def train(ticker="AAPL"):
+    end = datetime.utcnow().date().isoformat()
+    start = (datetime.utcnow().date() - timedelta(days=365*2)).isoformat()
+    window = 8
+    wires = 4
+    layers = 2
+    X, y, groups = build_dataset(ticker, start, end, window=window, normalize=True)
+    weights, _ = fit(X, y, groups, wires=wires, layers=layers, lr=0.01, epochs=3)
+    save(weights, window, wires, layers)
 
 if __name__ == "__main__":
-    train()
\ No newline at end of file
+    train()
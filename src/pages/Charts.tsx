@@ -3,11 +3,15 @@ import { Card } from "@/components/ui/card";
 import { Button } from "@/components/ui/button";
 import { Input } from "@/components/ui/input";
 import { Label } from "@/components/ui/label";
+import { Select, SelectTrigger, SelectContent, SelectItem, SelectValue } from "@/components/ui/select";
 import { toast } from "sonner";
 import { createChart, ColorType, CandlestickData, HistogramData, Time } from "lightweight-charts";
 
 type Row = { time: string; open: number; high: number; low: number; close: number; volume: number };
 
+// Upper bound on bars requested from /ohlc; the server merges bars beyond this into wider candles.
+const MAX_POINTS = 2000;
+
 function parseCsv(text: string) {
   const lines = text.trim().split(/\r?\n/);
   const header = lines[0].split(",").map((h) => h.trim().toLowerCase());
@@ -99,6 +103,7 @@ const Charts = () => {
   const [ticker, setTicker] = useState("TQQQ");
   const [startDate, setStartDate] = useState("");
   const [endDate, setEndDate] = useState("");
+  const [barInterval, setBarInterval] = useState("1d");
   const [file, setFile] = useState<File | null>(null);
   const [rows, setRows] = useState<Row[]>([]);
 
@@ -113,7 +118,7 @@ const Charts = () => {
   }
 
   function sanitizeRows(input: Row[]): Row[] {
-    const iso = /^\d{4}-\d{2}-\d{2}$/;
+    const iso = /^\d{4}-\d{2}-\d{2}(T\d{2}:\d{2}(:\d{2})?Z?)?$/;
     const map = new Map<string, Row>();
     for (const r of input) {
       if (!r || !iso.test(r.time)) continue;
@@ -186,7 +191,7 @@ const Charts = () => {
     try {
       const s = startDate || "";
       const e = endDate || "";
-      const q = new URLSearchParams({ ticker, start: s, end: e }).toString();
+      const q = new URLSearchParams({ ticker, start: s, end: e, interval: barInterval, max_points: String(MAX_POINTS) }).toString();
       const res = await fetch(`http://localhost:3002/ohlc?${q}`);
       const data = await res.json();
       const rowsData: Row[] = Array.isArray(data.rows) ? data.rows : [];
@@ -221,6 +226,21 @@ const Charts = () => {
                 <Input type="date" value={endDate} onChange={(e) => setEndDate(e.target.value)} />
               </div>
             </div>
+            <div className="space-y-2">
+              <Label htmlFor="interval">Interval</Label>
+              <Select value={barInterval} onValueChange={setBarInterval}>
+                <SelectTrigger id="interval">
+                  <SelectValue placeholder="Interval" />
+                </SelectTrigger>
+                <SelectContent>
+                  <SelectItem value="15m">15 minutes</SelectItem>
+                  <SelectItem value="1h">1 hour</SelectItem>
+                  <SelectItem value="1d">Daily</SelectItem>
+                  <SelectItem value="1wk">Weekly</SelectItem>
+                  <SelectItem value="1mo">Monthly</SelectItem>
+                </SelectContent>
+              </Select>
+            </div>
             <Button onClick={handleFetch} className="w-full gradient-quantum">Fetch</Button>
             <div className="space-y-2">
               <Label>Upload CSV</Label>